@@ -1,51 +1,274 @@
+import hashlib
+import os
 import re
+import threading
 import time
-from datetime import datetime
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
+from itertools import repeat
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
 
+import openpyxl
+import orjson
 import requests
 import pandas as pd
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import xlsxwriter
+except ImportError:  # exportação cai para openpyxl em modo write-only
+    xlsxwriter = None
 
 
 # =========================
 # 1) Configurações (APIs)
 # =========================
+APP_NAME = "Extrator_ORCID_Crossref"
+APP_VERSION = "1.1.0"
+APP_URL = "https://github.com/Danipontes/Extrator_Orcid_Crossref"
+
 ORCID_API = "https://pub.orcid.org/v3.0"
 CROSSREF_WORKS_API = "https://api.crossref.org/works"
 EVENTDATA_API = "https://api.eventdata.crossref.org/v1/events"
 
-# Pausa entre requisições para evitar rate limit
-SLEEP_SECONDS = 0.25
+# Retentativas com backoff exponencial (respeita Retry-After em 429/503)
+RETRY_TOTAL = 5
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Timeout HTTP (conexão, leitura): host inacessível falha rápido e entra no retry
+HTTP_TIMEOUT = (5, 30)
+
+# Concorrência: ORCIDs em paralelo, threads por work e requisições simultâneas por host
+MAX_ORCIDS_SIMULTANEOS = 4
+MAX_WORKERS = 16
+MAX_CONEXOES_POR_HOST = 8
+
+# Cache em disco das respostas JSON (TTL em segundos por host)
+CACHE_DIR = Path(".cache")
+CACHE_TTL_HOST = {
+    urlsplit(ORCID_API).netloc: 24 * 3600,
+    urlsplit(CROSSREF_WORKS_API).netloc: 24 * 3600,
+    urlsplit(EVENTDATA_API).netloc: 48 * 3600,
+}
+
+# Event Data: DOIs sem nenhum evento raramente mudam; a resposta vazia fica mais tempo no cache
+EVENTDATA_TTL_SEM_EVENTOS = 7 * 24 * 3600
+
+# Crossref: DOIs por consulta em lote (/works?filter=doi:...)
+CROSSREF_LOTE = 40
+
+# Crossref: só os campos usados em _campos_crossref (parâmetro select das consultas em lote)
+CROSSREF_SELECT = "DOI,is-referenced-by-count,references-count,container-title,publisher,issued"
+
+# Resultados completos memorizados por sessão do navegador (mesmas entradas = sem nova coleta)
+RESULTADOS_TTL = 24 * 3600
+RESULTADOS_MAX = 8
 
 # Event Data: tamanho de página e limite de páginas (segurança)
 EVENTDATA_ROWS = 1000
 EVENTDATA_MAX_PAGES = 50
 
+# ORCID normalizado (0000-0000-0000-000X)
+ORCID_REGEX = re.compile(r"\d{4}-\d{4}-\d{4}-\d{3}[\dX]")
+
+# DOI em texto livre/URL (heurística)
+DOI_REGEX = re.compile(r"10\.\d{4,9}/[^\s\"<>]+")
+DOI_PREFIXO_REGEX = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+
 # Colunas FIXAS por fonte (sempre aparecem no Excel, mesmo se 0)
 FONTES_FIXAS = [
     "twitter", "news", "blogs", "reddit", "wikipedia", "facebook",
     "policy", "patent", "stackexchange", "youtube", "linkedin", "unknown"
 ]
+FONTES_FIXAS_SET = frozenset(FONTES_FIXAS)
+
+# Tipos de work (ORCID) com pouca cobertura altmétrica: Event Data é pulado
+# quando não há citações na Crossref (opção "pular altmetria" na interface)
+TIPOS_SEM_ALTMETRIA = frozenset({
+    "data-set", "other", "software", "lecture-speech", "conference-poster",
+    "conference-abstract", "website", "online-resource",
+})
+
+# Colunas fixas da saída (ordem do DataFrame montado no pipeline)
+COLS_WORK = [
+    "orcid", "put_code", "title", "type", "publication_year_orcid", "source_orcid", "doi",
+]
+COLS_CROSSREF = [
+    "crossref_is_referenced_by_count", "crossref_references_count",
+    "crossref_container_title", "crossref_publisher", "crossref_issued_year",
+]
+COLS_EVENTDATA_FIXAS = [f"eventdata_source_{s}" for s in FONTES_FIXAS]
+COLS_METRICAS = COLS_CROSSREF + COLS_EVENTDATA_FIXAS
+COLS_METRICAS_SET = frozenset(COLS_METRICAS)
+COLS_SAIDA = COLS_WORK + COLS_METRICAS
+COLS_SAIDA_SET = frozenset(COLS_SAIDA)
+
+# Valores padrão (somente leitura) para works sem DOI ou com erro nas APIs
+CROSSREF_VAZIO = dict.fromkeys(COLS_CROSSREF)
+EVENTDATA_VAZIO = dict.fromkeys(COLS_EVENTDATA_FIXAS, 0)
+
+# pandas >= 3 sempre usa Copy-on-Write; no 2.x só se a opção estiver ligada (a opção é obsoleta no 3)
+_COPY_ON_WRITE = int(pd.__version__.split(".")[0]) >= 3 or pd.options.mode.copy_on_write is True
+
+# Um semáforo por host: limita chamadas simultâneas a cada API
+_SEMAFOROS_HOST = {
+    urlsplit(api).netloc: threading.BoundedSemaphore(MAX_CONEXOES_POR_HOST)
+    for api in (ORCID_API, CROSSREF_WORKS_API, EVENTDATA_API)
+}
+
+# Contadores do cache (processo inteiro): hit, revalidado (304), download
+ESTATISTICAS_CACHE = Counter()
+_ESTATISTICAS_CACHE_LOCK = threading.Lock()
+
+# Sessão HTTP compartilhada: keep-alive, pool de conexões por host e retry/backoff
+_retry = Retry(
+    total=RETRY_TOTAL,
+    backoff_factor=RETRY_BACKOFF,
+    backoff_jitter=RETRY_BACKOFF,
+    status_forcelist=RETRY_STATUS,
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+_session = requests.Session()
+_session.headers["User-Agent"] = f"{APP_NAME}/{APP_VERSION} (+{APP_URL})"
+for _api in (ORCID_API, CROSSREF_WORKS_API, EVENTDATA_API):
+    _session.mount(
+        f"https://{urlsplit(_api).netloc}",
+        HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONEXOES_POR_HOST, max_retries=_retry),
+    )
 
 
 # =========================
 # 2) Utilitários
 # =========================
-def get_json(url: str, headers=None, params=None, timeout=30) -> dict:
-    """GET com retorno JSON e tratamento de erro HTTP."""
-    r = requests.get(url, headers=headers, params=params, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
+def _chave_cache(url: str, params=None) -> str:
+    """SHA-256 de URL + parâmetros ordenados (sem mailto, que não altera a resposta)."""
+    itens = sorted((str(k), str(v)) for k, v in (params or {}).items() if k != "mailto")
+    return hashlib.sha256(f"{url}?{itens}".encode("utf-8")).hexdigest()
 
 
-def normalizar_orcid(orcid: str) -> str:
-    """Normaliza ORCID para 0000-0000-0000-0000 (se vier sem hífen)."""
-    o = str(orcid).strip().replace(" ", "")
-    raw = o.replace("-", "")
-    if len(raw) == 16:
-        return f"{raw[0:4]}-{raw[4:8]}-{raw[8:12]}-{raw[12:16]}"
-    return o
+def _cache_ler(chave: str):
+    """
+    Lê a entrada do cache e sua idade em segundos (mtime); (None, None) se não houver.
+    Entrada: {"dados", "url", "versao", "obtido_em", "etag", "last_modified"}.
+    """
+    path = CACHE_DIR / f"{chave}.json"
+    try:
+        idade = time.time() - path.stat().st_mtime
+        entrada = orjson.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None, None
+    if not isinstance(entrada, dict) or "dados" not in entrada:
+        return None, None
+    return entrada, idade
+
+
+def _cache_consultar(chave: str, host: str, ttl_vazio: int = None):
+    """
+    (entrada, fresca): entrada do cache (ou None) e se ainda está dentro do TTL do host.
+    ttl_vazio: TTL (segundos) usado no lugar do TTL do host quando a resposta não tem resultados.
+    """
+    entrada, idade = _cache_ler(chave)
+    if entrada is None:
+        return None, False
+    ttl = CACHE_TTL_HOST[host]
+    if ttl_vazio and _resposta_vazia(entrada["dados"]):
+        ttl = ttl_vazio
+    return entrada, idade <= ttl
+
+
+def _cache_renovar(chave: str) -> None:
+    """Reinicia o TTL de uma entrada revalidada (304) atualizando o mtime."""
+    try:
+        os.utime(CACHE_DIR / f"{chave}.json")
+    except OSError:
+        pass
+
+
+def _contar_cache(evento: str) -> None:
+    with _ESTATISTICAS_CACHE_LOCK:
+        ESTATISTICAS_CACHE[evento] += 1
+
+
+def _cache_gravar(chave: str, url: str, dados, headers=None) -> None:
+    """Grava resposta + metadados (headers HTTP) no cache (arquivo temporário + rename, seguro entre threads)."""
+    headers = headers or {}
+    entrada = {
+        "dados": dados,
+        "url": url,
+        "versao": APP_VERSION,
+        "obtido_em": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+    }
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        tmp = CACHE_DIR / f"{chave}.{threading.get_ident()}.tmp"
+        tmp.write_bytes(orjson.dumps(entrada))
+        os.replace(tmp, CACHE_DIR / f"{chave}.json")
+    except OSError:
+        pass
+
+
+def _resposta_vazia(dados) -> bool:
+    """True se a resposta (formato Crossref/Event Data) informa zero resultados."""
+    return isinstance(dados, dict) and (dados.get("message") or {}).get("total-results") == 0
+
+
+def get_json(
+    url: str,
+    headers=None,
+    params=None,
+    timeout=HTTP_TIMEOUT,
+    usar_cache: bool = True,
+    ttl_vazio: int = None,
+    gravar_cache: bool = True,
+) -> dict:
+    """
+    GET com retorno JSON, cache em disco e tratamento de erro HTTP (concorrência limitada por host).
+    Entradas vencidas com ETag/Last-Modified são revalidadas com GET condicional (304 reaproveita o cache).
+    Com usar_cache=False a consulta ignora o cache, mas a resposta nova é gravada nele.
+    ttl_vazio: TTL (segundos) usado no lugar do TTL do host quando a resposta em cache não tem resultados.
+    Com gravar_cache=False a resposta não é gravada (quem chama grava as partes que interessam).
+    """
+    host = urlsplit(url).netloc
+    chave = _chave_cache(url, params)
+    entrada = None
+
+    if usar_cache:
+        entrada, fresca = _cache_consultar(chave, host, ttl_vazio)
+        if fresca:
+            _contar_cache("hit")
+            return entrada["dados"]
+
+    if entrada is not None:
+        condicionais = {}
+        if entrada.get("etag"):
+            condicionais["If-None-Match"] = entrada["etag"]
+        if entrada.get("last_modified"):
+            condicionais["If-Modified-Since"] = entrada["last_modified"]
+        if condicionais:
+            headers = {**(headers or {}), **condicionais}
+
+    with _SEMAFOROS_HOST[host]:
+        r = _session.get(url, headers=headers, params=params, timeout=timeout)
+
+    if r.status_code == 304 and entrada is not None:
+        _cache_renovar(chave)
+        _contar_cache("revalidado")
+        return entrada["dados"]
+    r.raise_for_status()
+
+    dados = orjson.loads(r.content)
+    if gravar_cache:
+        _cache_gravar(chave, url, dados, r.headers)
+    _contar_cache("download")
+    return dados
 
 
 def extrair_doi_de_texto(texto: str):
@@ -53,53 +276,63 @@ def extrair_doi_de_texto(texto: str):
     if not texto:
         return None
     t = str(texto).strip()
-    m = re.search(r"(10\.\d{4,9}/[^\s\"<>]+)", t)
+    m = DOI_REGEX.search(t)
     if m:
-        return m.group(1).rstrip(").,;]")
+        return m.group(0).rstrip(").,;]")
     return None
 
 
+def chave_doi(doi: str) -> str:
+    """Forma canônica do DOI para deduplicar/juntar: decodificado, sem prefixo doi.org/doi: e em minúsculas."""
+    return DOI_PREFIXO_REGEX.sub("", unquote(str(doi).strip())).lower()
+
+
 def ler_orcids_do_excel(uploaded_file) -> list[str]:
     """
     Lê ORCIDs de um Excel (.xlsx).
     - Se existir coluna 'orcid' (case-insensitive), usa ela.
     - Senão, usa a primeira coluna.
-    - Remove vazios, normaliza e dedup mantendo ordem.
+    - Remove vazios, normaliza, descarta ORCIDs inválidos e dedup mantendo ordem.
     """
-    df_orcids = pd.read_excel(uploaded_file)
-
-    col_map = {c: str(c).strip().lower() for c in df_orcids.columns}
-    col_orcid = None
-    for original, low in col_map.items():
-        if low == "orcid":
-            col_orcid = original
-            break
-
-    if col_orcid is None:
-        col_orcid = df_orcids.columns[0]
-
-    orcids = []
-    seen = set()
-    for x in df_orcids[col_orcid].astype(str).tolist():
-        o = x.strip()
-        if not o or o.lower() in {"nan", "none"}:
-            continue
-        o = normalizar_orcid(o)
-        if o not in seen:
-            orcids.append(o)
-            seen.add(o)
+    # openpyxl em modo read-only (streaming, sem estilos) lendo só a coluna necessária
+    wb = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        cabecalho = next(ws.iter_rows(max_row=1, values_only=True), None)
+        if not cabecalho:
+            return []
+
+        nomes = [str(c).strip().lower() if c is not None else "" for c in cabecalho]
+        col = nomes.index("orcid") + 1 if "orcid" in nomes else 1
+        valores = [row[0] for row in ws.iter_rows(min_row=2, min_col=col, max_col=col, values_only=True)]
+    finally:
+        wb.close()
+
+    # Normaliza para 0000-0000-0000-0000 (sem espaços; hífens inseridos se vierem 16 caracteres),
+    # em operações vetorizadas sobre a coluna
+    s = pd.Series(valores, dtype=object).astype("string").str.strip()
+    s = s[s.notna() & (s != "") & ~s.str.lower().isin(["nan", "none"])]
+    s = s.str.replace(" ", "", regex=False).str.upper()
+
+    raw = s.str.replace("-", "", regex=False)
+    hifenizado = (
+        raw.str.slice(0, 4) + "-" + raw.str.slice(4, 8) + "-"
+        + raw.str.slice(8, 12) + "-" + raw.str.slice(12, 16)
+    )
+    s = hifenizado.where(raw.str.len() == 16, s)
 
-    return orcids
+    s = s[s.str.fullmatch(ORCID_REGEX)]
+    return s.drop_duplicates().tolist()
 
 
 # =========================
 # 3) ORCID: listar works e pegar DOI
 # =========================
-def listar_works_orcid(orcid: str) -> list[dict]:
+def listar_works_orcid(orcid: str, usar_cache: bool = True) -> list[dict]:
     """Lista works (resumo) do ORCID."""
     headers = {"Accept": "application/json"}
     url = f"{ORCID_API}/{orcid}/works"
-    data = get_json(url, headers=headers)
+    data = get_json(url, headers=headers, usar_cache=usar_cache)
 
     works = []
     for g in data.get("group", []):
@@ -114,40 +347,34 @@ def listar_works_orcid(orcid: str) -> list[dict]:
     return works
 
 
-def detalhes_work_orcid(orcid: str, put_code: int) -> dict:
+def detalhes_work_orcid(orcid: str, put_code: int, usar_cache: bool = True) -> dict:
     """Busca detalhes de um work do ORCID (onde aparecem external-ids)."""
     headers = {"Accept": "application/json"}
     url = f"{ORCID_API}/{orcid}/work/{put_code}"
-    return get_json(url, headers=headers)
+    return get_json(url, headers=headers, usar_cache=usar_cache)
 
 
 def extrair_doi_do_work_orcid(work_detail: dict):
     """Extrai DOI dos external-ids do work do ORCID."""
     ext_ids = (work_detail.get("external-ids") or {}).get("external-id", [])
 
+    # Uma passada: id do tipo "doi" tem prioridade; senão, o primeiro valor com cara de DOI
+    fallback = None
     for eid in ext_ids:
+        valor = (eid.get("external-id-value") or "").strip()
         if (eid.get("external-id-type") or "").lower() == "doi":
-            valor = (eid.get("external-id-value") or "").strip()
             return extrair_doi_de_texto(valor) or (valor or None)
+        if fallback is None:
+            fallback = extrair_doi_de_texto(valor)
 
-    for eid in ext_ids:
-        valor = (eid.get("external-id-value") or "").strip()
-        doi = extrair_doi_de_texto(valor)
-        if doi:
-            return doi
-
-    return None
+    return fallback
 
 
 # =========================
 # 4) Crossref (bibliometria)
 # =========================
-def crossref_por_doi(doi: str, email: str) -> dict:
-    url = f"{CROSSREF_WORKS_API}/{doi}"
-    params = {"mailto": email} if email else {}
-    data = get_json(url, params=params)
-    msg = data.get("message", {})
-
+def _campos_crossref(msg: dict) -> dict:
+    """Campos de interesse de um registro (message/item) da Crossref."""
     return {
         "crossref_is_referenced_by_count": msg.get("is-referenced-by-count"),
         "crossref_references_count": msg.get("references-count"),
@@ -157,11 +384,125 @@ def crossref_por_doi(doi: str, email: str) -> dict:
     }
 
 
+def _url_crossref_doi(doi: str) -> str:
+    """URL /works/{doi}; também é a chave de cache por DOI (consultas individuais e itens dos lotes)."""
+    return f"{CROSSREF_WORKS_API}/{doi}"
+
+
+def crossref_por_doi(doi: str, email: str, usar_cache: bool = True) -> dict:
+    url = _url_crossref_doi(doi)
+    params = {"mailto": email} if email else {}
+    data = get_json(url, params=params, usar_cache=usar_cache)
+    return _campos_crossref(data.get("message", {}))
+
+
+def _crossref_lote(dois: list[str], email: str) -> dict:
+    """
+    Uma consulta /works?filter=doi:A,doi:B,... -> {chave_doi: campos}.
+    Se o lote falhar (erro HTTP após as retentativas), os DOIs são consultados um a um. O lote não é cacheado como um todo: cada item é gravado na chave do seu DOI (/works/{doi}).
+    """
+    params = {
+        "filter": ",".join(f"doi:{d}" for d in dois),
+        "rows": len(dois),
+        "select": CROSSREF_SELECT,
+    }
+    if email:
+        params["mailto"] = email
+    try:
+        data = get_json(CROSSREF_WORKS_API, params=params, usar_cache=False, gravar_cache=False)
+    except Exception:
+        individuais = {d: _crossref_individual(d, email, usar_cache=False) for d in dois}
+        return {d: campos for d, campos in individuais.items() if campos is not None}
+
+    out = {}
+    for item in ((data.get("message") or {}).get("items") or []):
+        doi = chave_doi(item.get("DOI") or "")
+        if doi:
+            url = _url_crossref_doi(doi)
+            _cache_gravar(_chave_cache(url), url, {"message": item})
+            out[doi] = _campos_crossref(item)
+    return out
+
+
+def _crossref_individual(doi: str, email: str, usar_cache: bool = True):
+    """crossref_por_doi com None em caso de erro (DOI não encontrado, falha HTTP)."""
+    try:
+        return crossref_por_doi(doi, email, usar_cache=usar_cache)
+    except Exception:
+        return None
+
+
+def crossref_por_dois(
+    dois: list[str],
+    email: str,
+    lote: int = CROSSREF_LOTE,
+    usar_cache: bool = True,
+    executor: ThreadPoolExecutor = None,
+) -> dict:
+    """
+    Crossref em lote via /works?filter=doi:A,doi:B,... (lotes em paralelo se houver `executor`).
+    Retorna {chave_doi: campos}; DOIs não encontrados (ou de lotes com erro) ficam de fora.
+    O cache é por DOI: só os DOIs sem entrada válida entram nos lotes. Entradas vencidas com
+    ETag/Last-Modified e DOIs com vírgula (quebrariam o filtro) seguem pela consulta individual.
+    """
+    unicos = list(dict.fromkeys(chave_doi(d) for d in dois if d))
+    host = urlsplit(CROSSREF_WORKS_API).netloc
+    mapear = executor.map if executor is not None else map
+
+    out = {}
+    filtraveis = []
+    individuais = []
+    for d in unicos:
+        entrada, fresca = _cache_consultar(_chave_cache(_url_crossref_doi(d)), host) if usar_cache else (None, False)
+        if fresca:
+            _contar_cache("hit")
+            out[d] = _campos_crossref(entrada["dados"].get("message") or {})
+        elif "," in d or (entrada is not None and (entrada.get("etag") or entrada.get("last_modified"))):
+            individuais.append(d)
+        else:
+            filtraveis.append(d)
+
+    lotes = [filtraveis[i:i + lote] for i in range(0, len(filtraveis), lote)]
+    for parcial in mapear(_crossref_lote, lotes, repeat(email)):
+        out.update(parcial)
+
+    for d, campos in zip(individuais, mapear(_crossref_individual, individuais, repeat(email), repeat(usar_cache))):
+        if campos is not None:
+            out[d] = campos
+
+    return out
+
+
 # =========================
 # 5) Event Data (altmetria) — por fonte
 # =========================
-def eventdata_por_doi(doi: str, email: str, rows: int = EVENTDATA_ROWS, max_pages: int = EVENTDATA_MAX_PAGES) -> dict:
-    contagem_por_fonte = {}
+def _eventdata_facetas(doi: str, email: str, usar_cache: bool = True):
+    """
+    Contagem por fonte agregada no servidor (facet=source:*, rows=0): uma única chamada, sem paginar eventos.
+    Retorna None se a API não devolver as facetas (ou recusar o parâmetro).
+    """
+    params = {"obj-id": f"https://doi.org/{doi}", "rows": 0, "facet": "source:*"}
+    if email:
+        params["mailto"] = email
+
+    try:
+        data = get_json(EVENTDATA_API, params=params, usar_cache=usar_cache, ttl_vazio=EVENTDATA_TTL_SEM_EVENTOS)
+    except requests.HTTPError:
+        return None
+
+    facetas = (((data.get("message") or {}).get("facets") or {}).get("source"))
+    if facetas is None:
+        return None
+
+    contagem = Counter()
+    for src, cont in (facetas.get("values") or {}).items():
+        contagem[str(src).strip() or "unknown"] += int(cont)
+    return contagem
+
+
+def _eventdata_paginado(doi: str, email: str, rows: int, max_pages: int, usar_cache: bool = True) -> Counter:
+    """Contagem por fonte percorrendo as páginas de eventos (cursor)."""
+    contagem_por_fonte = Counter()
     cursor = None
     page = 0
 
@@ -176,9 +517,7 @@ def eventdata_por_doi(doi: str, email: str, rows: int = EVENTDATA_ROWS, max_page
         if cursor:
             params["cursor"] = cursor
 
-        r = requests.get(EVENTDATA_API, params=params, timeout=30)
-        r.raise_for_status()
-        data = r.json()
+        data = get_json(EVENTDATA_API, params=params, usar_cache=usar_cache, ttl_vazio=EVENTDATA_TTL_SEM_EVENTOS)
 
         message = (data.get("message") or {})
         events = (message.get("events") or [])
@@ -186,23 +525,33 @@ def eventdata_por_doi(doi: str, email: str, rows: int = EVENTDATA_ROWS, max_page
         if not events:
             break
 
-        for ev in events:
-            src = (ev.get("source") or "unknown").strip() or "unknown"
-            contagem_por_fonte[src] = contagem_por_fonte.get(src, 0) + 1
+        contagem_por_fonte.update((ev.get("source") or "unknown").strip() or "unknown" for ev in events)
 
         next_cursor = message.get("next-cursor")
         if not next_cursor or next_cursor == cursor:
             break
 
         cursor = next_cursor
-        time.sleep(SLEEP_SECONDS)
 
-    out = {f"eventdata_source_{s}": int(contagem_por_fonte.get(s, 0)) for s in FONTES_FIXAS}
+    return contagem_por_fonte
+
+
+def eventdata_por_doi(
+    doi: str,
+    email: str,
+    rows: int = EVENTDATA_ROWS,
+    max_pages: int = EVENTDATA_MAX_PAGES,
+    usar_cache: bool = True,
+) -> dict:
+    contagem_por_fonte = _eventdata_facetas(doi, email, usar_cache)
+    if contagem_por_fonte is None:
+        contagem_por_fonte = _eventdata_paginado(doi, email, rows, max_pages, usar_cache)
+
+    out = {f"eventdata_source_{s}": int(contagem_por_fonte[s]) for s in FONTES_FIXAS}
 
     for fonte, cont in contagem_por_fonte.items():
-        col = f"eventdata_source_{fonte}"
-        if col not in out:
-            out[col] = int(cont)
+        if fonte not in FONTES_FIXAS_SET:
+            out[f"eventdata_source_{fonte}"] = int(cont)
 
     return out
 
@@ -210,114 +559,265 @@ def eventdata_por_doi(doi: str, email: str, rows: int = EVENTDATA_ROWS, max_page
 # =========================
 # 6) Pipeline (lista ORCIDs -> DataFrame)
 # =========================
+def _doi_do_work(orcid: str, put_code: int, usar_cache: bool = True):
+    """Busca o detalhe do work e devolve o DOI (ou None em caso de erro)."""
+    try:
+        detail = detalhes_work_orcid(orcid, put_code, usar_cache)
+        return extrair_doi_do_work_orcid(detail)
+    except Exception:
+        return None
+
+
+def _eventdata_do_doi(doi, email: str, usar_cache: bool = True) -> dict:
+    """Event Data de um DOI, com contagens zeradas em caso de erro ou sem DOI."""
+    if not doi:
+        return EVENTDATA_VAZIO
+    try:
+        return eventdata_por_doi(doi, email, usar_cache=usar_cache)
+    except Exception:
+        return EVENTDATA_VAZIO
+
+
+def _pular_eventdata(work: dict, doi, crossref: dict) -> bool:
+    """True se o work é de tipo pouco coberto por altmetria e não tem citações na Crossref."""
+    if not doi or work.get("type") not in TIPOS_SEM_ALTMETRIA:
+        return False
+    citacoes = crossref.get(chave_doi(doi), CROSSREF_VAZIO)["crossref_is_referenced_by_count"]
+    return citacoes in (None, 0)
+
+
+def _works_e_dois(orcid: str, executor: ThreadPoolExecutor, usar_cache: bool):
+    """
+    Etapa 1 para um ORCID: works + DOI de cada work -> (works, dois, mensagens de log).
+    Roda numa thread própria; os detalhes dos works vão para o pool `executor`.
+    """
+    mensagens = []
+    try:
+        works = listar_works_orcid(orcid, usar_cache)
+        mensagens.append(f"  - Works no ORCID: {len(works)}")
+    except Exception as e:
+        mensagens.append(f"  ! Erro ao listar works do ORCID {orcid}: {e}")
+        return [], [], mensagens
+
+    dois = list(executor.map(
+        _doi_do_work, repeat(orcid), [w["put_code"] for w in works], repeat(usar_cache),
+    ))
+    for i, w in enumerate(works, start=1):
+        mensagens.append(f"    [{i}/{len(works)}] put-code={w['put_code']} | {w.get('title')}")
+
+    return works, dois, mensagens
+
+
 def coletar_para_lista_orcids(
     orcids: list[str],
     email: str,
     logger=None,
     progress_cb=None,
+    pular_altmetria_sem_citacoes: bool = False,
+    usar_cache: bool = True,
 ) -> pd.DataFrame:
-    linhas = []
+    """
+    Coleta works/DOIs/métricas para cada ORCID (já normalizado, como em ler_orcids_do_excel), em etapas:
+    1) works + DOIs por ORCID (até MAX_ORCIDS_SIMULTANEOS ORCIDs ao mesmo tempo);
+    2) Crossref em lote sobre todos os DOIs da execução;
+    3) Event Data por DOI, em paralelo.
+    Logs e progresso ficam na thread principal; as linhas saem na ordem de entrada.
+    """
     total_orcids = len(orcids)
+    works_dois = [([], [])] * total_orcids
+    cache_inicio = Counter(ESTATISTICAS_CACHE)
 
-    for idx_orcid, orcid_in in enumerate(orcids, start=1):
-        orcid = normalizar_orcid(orcid_in)
-
-        if logger:
-            logger(f"[ORCID {idx_orcid}/{total_orcids}] {orcid}")
-
-        try:
-            time.sleep(SLEEP_SECONDS)
-            works = listar_works_orcid(orcid)
-            if logger:
-                logger(f"  - Works no ORCID: {len(works)}")
-        except Exception as e:
-            if logger:
-                logger(f"  ! Erro ao listar works do ORCID {orcid}: {e}")
-            continue
-
-        for i, w in enumerate(works, start=1):
-            put_code = w["put_code"]
-            title = w.get("title")
+    def progresso(p: float):
+        if progress_cb:
+            progress_cb(p)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, \
+            ThreadPoolExecutor(max_workers=MAX_ORCIDS_SIMULTANEOS) as executor_orcids:
+        # Etapa 1 (0% -> 50%)
+        futuros = {
+            executor_orcids.submit(_works_e_dois, orcid, executor, usar_cache): idx
+            for idx, orcid in enumerate(orcids)
+        }
+        for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+            idx = futuros[futuro]
+            works, dois, mensagens = futuro.result()
+            works_dois[idx] = (works, dois)
 
             if logger:
-                logger(f"    [{i}/{len(works)}] put-code={put_code} | {title}")
+                logger(f"[ORCID {idx + 1}/{total_orcids}] {orcids[idx]}")
+                for msg in mensagens:
+                    logger(msg)
+            progresso(0.5 * concluidos / max(total_orcids, 1))
+
+        # Etapa 2 (-> 60%): Crossref em lote, uma vez por DOI da execução
+        # DOIs deduplicados pela forma canônica: coautorias entre ORCIDs e variantes
+        # (URL doi.org, prefixo doi:, caixa, %-encoding) viram uma única consulta
+        dois_works = [chave_doi(d) for _, dois in works_dois for d in dois if d]
+        dois_unicos = list(dict.fromkeys(dois_works))
+        if logger:
+            logger(
+                f"Crossref: {len(dois_unicos)} DOIs únicos (de {len(dois_works)} works com DOI) "
+                f"em lotes de {CROSSREF_LOTE}"
+            )
+        crossref = crossref_por_dois(dois_unicos, email, usar_cache=usar_cache, executor=executor)
+        if logger and len(crossref) < len(dois_unicos):
+            logger(
+                f"Crossref: {len(dois_unicos) - len(crossref)} de {len(dois_unicos)} DOIs sem dados "
+                "(não encontrados ou falha na consulta)"
+            )
+        progresso(0.6)
+
+        # Etapa 3 (-> 100%): Event Data, uma vez por DOI (exceto works pulados)
+        pular = [
+            [pular_altmetria_sem_citacoes and _pular_eventdata(w, d, crossref) for w, d in zip(works, dois)]
+            for works, dois in works_dois
+        ]
+        dois_eventdata = dict.fromkeys(
+            chave_doi(d)
+            for (works, dois), pulados in zip(works_dois, pular)
+            for d, p in zip(dois, pulados)
+            if d and not p
+        )
+        if logger:
+            logger(f"Event Data: {len(dois_eventdata)} DOIs únicos")
+
+        eventdata = {}
+        futuros = {executor.submit(_eventdata_do_doi, d, email, usar_cache): d for d in dois_eventdata}
+        for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+            eventdata[futuros[futuro]] = futuro.result()
+            progresso(0.6 + 0.4 * concluidos / len(futuros))
+        progresso(1.0)
+
+    if logger:
+        cache = ESTATISTICAS_CACHE - cache_inicio
+        logger(
+            f"Cache: {cache['hit']} respostas do cache, {cache['revalidado']} revalidadas (304), "
+            f"{cache['download']} baixadas"
+        )
 
-            doi = None
-            try:
-                time.sleep(SLEEP_SECONDS)
-                detail = detalhes_work_orcid(orcid, put_code)
-                doi = extrair_doi_do_work_orcid(detail)
-            except Exception:
-                doi = None
+    linhas = []
+    cols_extras = set()  # fontes do Event Data fora de FONTES_FIXAS (união de todas as linhas)
+    for orcid, (works, dois), pulados in zip(orcids, works_dois, pular):
+        for w, doi, pulou in zip(works, dois, pulados):
+            cr = crossref.get(chave_doi(doi), CROSSREF_VAZIO) if doi else CROSSREF_VAZIO
+            ed = eventdata[chave_doi(doi)] if doi and not pulou else EVENTDATA_VAZIO
 
             linha = {
                 "orcid": orcid,
-                "put_code": put_code,
-                "title": title,
+                "put_code": w["put_code"],
+                "title": w.get("title"),
                 "type": w.get("type"),
                 "publication_year_orcid": w.get("publication_year_orcid"),
                 "source_orcid": w.get("source_orcid"),
                 "doi": doi,
+                **cr,
+                **{c: ed.get(c) for c in COLS_EVENTDATA_FIXAS},
             }
-
-            if doi:
-                try:
-                    time.sleep(SLEEP_SECONDS)
-                    linha.update(crossref_por_doi(doi, email))
-                except Exception:
-                    linha.update({
-                        "crossref_is_referenced_by_count": None,
-                        "crossref_references_count": None,
-                        "crossref_container_title": None,
-                        "crossref_publisher": None,
-                        "crossref_issued_year": None,
-                    })
-
-                try:
-                    time.sleep(SLEEP_SECONDS)
-                    linha.update(eventdata_por_doi(doi, email))
-                except Exception:
-                    for s in FONTES_FIXAS:
-                        linha[f"eventdata_source_{s}"] = 0
-            else:
-                for s in FONTES_FIXAS:
-                    linha[f"eventdata_source_{s}"] = 0
-
+            for c, v in ed.items():
+                if c not in COLS_METRICAS_SET:
+                    linha[c] = v
+                    cols_extras.add(c)
             linhas.append(linha)
 
-        if progress_cb:
-            progress_cb(idx_orcid / max(total_orcids, 1))
+    # DataFrame montado uma única vez, com todas as colunas já conhecidas
+    return pd.DataFrame.from_records(linhas, columns=COLS_SAIDA + sorted(cols_extras))
+
 
-    return pd.DataFrame(linhas)
+def coletar_com_cache(
+    orcids: list,
+    email: str,
+    logger=None,
+    progress_cb=None,
+    pular_altmetria_sem_citacoes: bool = False,
+    usar_cache: bool = True,
+) -> pd.DataFrame:
+    """
+    coletar_para_lista_orcids memoizado na sessão (st.session_state), por (ORCIDs, email, opção).
+    Num acerto da memória logger/progress_cb não são chamados; com usar_cache=False a coleta é refeita.
+    """
+    memoria = st.session_state.setdefault("resultados_coleta", {})
+    chave = (tuple(orcids), email, pular_altmetria_sem_citacoes)
+
+    item = memoria.get(chave)
+    if usar_cache and item is not None and time.time() - item[0] <= RESULTADOS_TTL:
+        return item[1]
+
+    df = coletar_para_lista_orcids(
+        orcids,
+        email,
+        logger=logger,
+        progress_cb=progress_cb,
+        pular_altmetria_sem_citacoes=pular_altmetria_sem_citacoes,
+        usar_cache=usar_cache,
+    )
+    memoria.pop(chave, None)
+    memoria[chave] = (time.time(), df)
+    while len(memoria) > RESULTADOS_MAX:
+        memoria.pop(next(iter(memoria)))
+    return df
 
 
-def ordenar_colunas(df: pd.DataFrame) -> pd.DataFrame:
-    cols_base = [
-        "orcid", "put_code", "title", "type", "publication_year_orcid", "source_orcid", "doi",
-        "crossref_is_referenced_by_count", "crossref_references_count",
-        "crossref_container_title", "crossref_publisher", "crossref_issued_year",
-    ]
+def compactar_tipos(df: pd.DataFrame) -> pd.DataFrame:
+    """Contagens/anos/put-code em Int64 (nulável) e textos em string[pyarrow], no lugar de object."""
+    tipos = {}
+    for c in df.columns:
+        if c == "put_code" or c.startswith("eventdata_source_") or c.endswith("_count") or c.endswith("_year"):
+            tipos[c] = "Int64"
+        elif c in COLS_WORK or c in ("crossref_container_title", "crossref_publisher"):
+            tipos[c] = "string[pyarrow]"
+    return df.astype(tipos)
 
-    cols_fixas = [f"eventdata_source_{s}" for s in FONTES_FIXAS if f"eventdata_source_{s}" in df.columns]
 
-    cols_outras = sorted([
-        c for c in df.columns
-        if c.startswith("eventdata_source_") and c not in set(cols_fixas)
-    ])
+def ordenar_colunas(df: pd.DataFrame) -> pd.DataFrame:
+    """Colunas fixas (COLS_SAIDA) na ordem definida, depois fontes extras do Event Data (ordenadas) e o restante."""
+    presentes = set(df.columns)
+    cols_fixas = [c for c in COLS_SAIDA if c in presentes]
 
-    cols_out = [c for c in cols_base if c in df.columns] + cols_fixas + cols_outras + \
-               [c for c in df.columns if c not in set(cols_base + cols_fixas + cols_outras)]
+    cols_fora = [c for c in df.columns if c not in COLS_SAIDA_SET]
+    cols_fontes = sorted(c for c in cols_fora if c.startswith("eventdata_source_"))
+    cols_restantes = [c for c in cols_fora if not c.startswith("eventdata_source_")]
 
-    return df[cols_out].copy()
+    # Sem cópia defensiva: o resultado só é lido (prévia e exportação).
+    # Com Copy-on-Write o reindex não copia os dados e copy= é obsoleto; sem ele (pandas 2.x
+    # padrão) o reindex copia, a menos que receba copy=False.
+    sem_copia = {} if _COPY_ON_WRITE else {"copy": False}
+    return df.reindex(columns=cols_fixas + cols_fontes + cols_restantes, **sem_copia)
 
 
 def df_para_excel_bytes(df_out: pd.DataFrame) -> bytes:
+    """
+    Gera o Excel em streaming, linha a linha: xlsxwriter em modo constant_memory (linhas vão
+    para disco à medida que são escritas) ou, sem xlsxwriter, openpyxl em modo write-only.
+    O writer do pandas grava por coluna, o que não funciona no constant_memory.
+    """
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df_out.to_excel(writer, index=False, sheet_name="dados")
+    cabecalho = [str(c) for c in df_out.columns]
+    valores = df_out.astype(object).where(df_out.notna(), None)
+    linhas = valores.itertuples(index=False, name=None)
+
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+        ws = workbook.add_worksheet("dados")
+        ws.write_row(0, 0, cabecalho)
+        for idx, row in enumerate(linhas, start=1):
+            ws.write_row(idx, 0, row)
+        workbook.close()
+    else:
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("dados")
+        ws.append(cabecalho)
+        for row in linhas:
+            ws.append(row)
+        wb.save(output)
+
     return output.getvalue()
 
 
+def df_para_csv_bytes(df_out: pd.DataFrame) -> bytes:
+    """CSV UTF-8 com BOM (acentos abrem corretamente no Excel)."""
+    return df_out.to_csv(index=False).encode("utf-8-sig")
+
+
 # =========================
 # 7) UI (Streamlit)
 # =========================
@@ -367,6 +867,25 @@ with st.expander("Formato do Excel esperado", expanded=False):
         """.strip()
     )
 
+pular_altmetria = st.checkbox(
+    "Pular Event Data para works sem citações de tipos pouco cobertos por altmetria",
+    value=False,
+    help="Tipos como data-set, software e other com 0 citações na Crossref ficam com menções zeradas, sem consulta ao Event Data.",
+)
+
+formato = st.radio(
+    "Formato do arquivo de saída",
+    options=["xlsx", "csv"],
+    horizontal=True,
+    help="CSV é bem mais rápido de gerar para coletas grandes.",
+)
+
+forcar_recoleta = st.checkbox(
+    "Forçar recoleta (ignorar cache)",
+    value=False,
+    help="Consulta novamente todas as APIs; as respostas novas substituem as do cache local.",
+)
+
 run = st.button("Executar extração", type="primary", use_container_width=True)
 
 st.divider()
@@ -394,41 +913,70 @@ if run:
     log_box = st.empty()
 
     logs = []
+    logs_tail = deque(maxlen=40)
+    ultimo_log = [0.0]
+    ultimo_progresso = [0.0]
+    intervalo_ui = 0.2  # segundos entre atualizações da interface (websocket)
+
+    def flush_log():
+        log_box.code("\n".join(logs_tail), language="text")
+        ultimo_log[0] = time.monotonic()
 
     def logger(msg: str):
         logs.append(msg)
-        log_box.code("\n".join(logs[-40:]), language="text")
+        logs_tail.append(msg)
+        if time.monotonic() - ultimo_log[0] > intervalo_ui:
+            flush_log()
 
     def progress_cb(p: float):
-        progress.progress(min(max(p, 0.0), 1.0))
+        agora = time.monotonic()
+        if p >= 1.0 or agora - ultimo_progresso[0] > intervalo_ui:
+            progress.progress(min(max(p, 0.0), 1.0))
+            ultimo_progresso[0] = agora
 
     with st.spinner("Coletando dados (ORCID → Crossref → Event Data)..."):
-        df = coletar_para_lista_orcids(
-            orcids=orcids,
-            email=email.strip(),
+        df = coletar_com_cache(
+            orcids,
+            email.strip(),
             logger=logger,
             progress_cb=progress_cb,
+            pular_altmetria_sem_citacoes=pular_altmetria,
+            usar_cache=not forcar_recoleta,
         )
+    if not logs:
+        logger("Resultado reaproveitado da memória (mesmas entradas de uma execução recente).")
+    flush_log()
+    progress.progress(1.0)
 
     if df.empty:
         st.warning("A coleta foi concluída, mas não gerou linhas (verifique ORCIDs e disponibilidade nas APIs).")
         st.stop()
 
-    df_out = ordenar_colunas(df)
-    excel_bytes = df_para_excel_bytes(df_out)
+    df_out = ordenar_colunas(compactar_tipos(df))
 
-    filename = f"orcid_crossref_eventdata_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    filename = f"orcid_crossref_eventdata_{time.strftime('%Y%m%d_%H%M%S')}.{formato}"
 
     st.success(f"Coleta finalizada. Linhas: {len(df_out)}")
-    st.dataframe(df_out.head(25), use_container_width=True)
-
-    st.download_button(
-        label="📥 Baixar Excel (aba: dados)",
-        data=excel_bytes,
-        file_name=filename,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        use_container_width=True
-    )
+    with st.expander("Prévia (25 linhas)", expanded=False):
+        # Só a fatia vai para o navegador; tipos já compactados em compactar_tipos
+        st.dataframe(df_out.head(25), use_container_width=True)
+
+    if formato == "csv":
+        st.download_button(
+            label="📥 Baixar CSV",
+            data=df_para_csv_bytes(df_out),
+            file_name=filename,
+            mime="text/csv",
+            use_container_width=True
+        )
+    else:
+        st.download_button(
+            label="📥 Baixar Excel (aba: dados)",
+            data=df_para_excel_bytes(df_out),
+            file_name=filename,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
 
     with st.expander("Log completo", expanded=False):
         st.code("\n".join(logs), language="text")